@@ -13,6 +13,7 @@
 # limitations under the License.
 # ==============================================================================
 import itertools
+import os
 from typing import Optional, Sequence
 
 from absl.testing import parameterized
@@ -22,6 +23,7 @@ from tensorflow.compiler.mlir.quantization.stablehlo.python import quantization
 from tensorflow.compiler.mlir.quantization.stablehlo.python.integration_test import quantize_model_test_base
 from tensorflow.compiler.mlir.quantization.tensorflow import quantization_options_pb2 as quant_opts_pb2
 from tensorflow.compiler.mlir.quantization.tensorflow.python import representative_dataset as repr_dataset
+from tensorflow.python.framework import dtypes
 from tensorflow.python.framework import ops
 from tensorflow.python.framework import test_util
 from tensorflow.python.platform import test
@@ -48,18 +50,34 @@ def parameter_combinations(test_parameters):
 class StaticRangeQuantizationTest(quantize_model_test_base.QuantizedModelTest):
 
   @parameterized.parameters(
-      parameter_combinations([{
-          'activation_fn': [None],
-          'has_bias': [True, False],
-          'dim_sizes': [
-              # tf.MatMul cases.
-              ([None, 1024], [1024, 3]),  # dynamic batch dim.
-              ([1, 1024], [1024, 3]),
-              # tf.BatchMatMul cases.
-              ([10, 1, 1024], [10, 1024, 3]),
-              ([2, 3, 1, 1024], [2, 3, 1024, 3]),
-          ],
-      }])
+      parameter_combinations([
+          {
+              'activation_fn': [None],
+              'has_bias': [True, False],
+              'dim_sizes': [
+                  # tf.MatMul cases.
+                  ([None, 1024], [1024, 3]),  # dynamic batch dim.
+                  ([1, 1024], [1024, 3]),
+                  # tf.BatchMatMul cases.
+                  ([10, 1, 1024], [10, 1024, 3]),
+                  ([2, 3, 1, 1024], [2, 3, 1024, 3]),
+              ],
+          },
+          # Input model saved without the variable checkpoint.
+          {
+              'activation_fn': [None],
+              'has_bias': [False],
+              'dim_sizes': [([1, 1024], [1024, 3])],
+              'skip_checkpoint': [True],
+          },
+          # Input model with weights stored as int8.
+          {
+              'activation_fn': [None],
+              'has_bias': [False],
+              'dim_sizes': [([1, 1024], [1024, 3])],
+              'write_int8_weights': [True],
+          },
+      ])
   )
   @test_util.run_in_graph_and_eager_modes
   def test_matmul_ptq_model(
@@ -67,8 +85,11 @@ class StaticRangeQuantizationTest(quantize_model_test_base.QuantizedModelTest):
       activation_fn: Optional[ops.Operation],
       has_bias: bool,
       dim_sizes: Sequence[int],
+      skip_checkpoint: bool = False,
+      write_int8_weights: bool = False,
   ):
     target_opset = quant_opts_pb2.STABLEHLO
+    self._write_int8_weights = write_int8_weights
 
     lhs_dim_size, rhs_dim_size = dim_sizes
     input_shape = (*lhs_dim_size,)
@@ -80,6 +101,7 @@ class StaticRangeQuantizationTest(quantize_model_test_base.QuantizedModelTest):
         self._input_saved_model_path,
         has_bias,
         activation_fn,
+        skip_checkpoint=skip_checkpoint,
     )
 
     rng = np.random.default_rng(seed=1235)
@@ -397,6 +419,22 @@ class StaticRangeQuantizationTest(quantize_model_test_base.QuantizedModelTest):
     # values are arbitrary.
     self.assertAllClose(new_outputs, expected_outputs, rtol=0.02, atol=0.04)
 
+  def test_matmul_model_without_save(self):
+    model = self._create_matmul_model(
+        input_shape=(1, 1024),
+        weight_shape=(1024, 3),
+        saved_model_path=self._input_saved_model_path,
+        save=False,
+    )
+    self.assertEmpty(os.listdir(self._input_saved_model_path))
+
+    rng = np.random.default_rng(seed=1235)
+    input_data = ops.convert_to_tensor(
+        rng.uniform(low=0.0, high=1.0, size=(1, 1024)).astype(np.float32)
+    )
+    outputs = model.matmul(input_data)
+    self.assertEqual(outputs['output'].shape, (1, 3))
+
   def test_when_preset_not_srq_raise_error(self):
     self._create_matmul_model(
         input_shape=(1, 1024),
@@ -421,5 +459,31 @@ class StaticRangeQuantizationTest(quantize_model_test_base.QuantizedModelTest):
       )
 
 
+class WeightConstantTest(test.TestCase):
+
+  def test_int8_weight_is_dequantized_to_original_values(self):
+    weight = np.array([[-1.0, 0.5], [0.25, 1.0]], dtype=np.float32)
+    quantized_weight, scale = quantize_model_test_base.create_weight_constant(
+        weight, quantize=True
+    )
+    self.assertEqual(quantized_weight.dtype, dtypes.int8)
+    self.assertAllClose(
+        quantize_model_test_base.dequantize_weight(quantized_weight, scale),
+        weight,
+        atol=scale,
+    )
+
+  def test_all_zero_int8_weight_is_dequantized_to_zero(self):
+    weight = np.zeros((4, 3), dtype=np.float32)
+    quantized_weight, scale = quantize_model_test_base.create_weight_constant(
+        weight, quantize=True
+    )
+    self.assertEqual(scale, 1.0)
+    self.assertAllEqual(
+        quantize_model_test_base.dequantize_weight(quantized_weight, scale),
+        weight,
+    )
+
+
 if __name__ == '__main__':
   test.main()
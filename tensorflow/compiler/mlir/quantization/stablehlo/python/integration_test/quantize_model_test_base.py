@@ -13,11 +13,14 @@
 # limitations under the License.
 # ==============================================================================
 """Base test class for quantize_model Tests."""
-from typing import Mapping, Sequence, Optional, Tuple, List
+import functools
+import shutil
+import tempfile
+from typing import Any, Mapping, Sequence, Optional, Tuple, List
 
+from absl.testing import absltest
 from absl.testing import parameterized
 import numpy as np
-import tensorflow  # pylint: disable=unused-import
 
 from tensorflow.python.eager import def_function
 from tensorflow.python.framework import dtypes
@@ -27,26 +30,152 @@ from tensorflow.python.module import module
 from tensorflow.python.ops import array_ops
 from tensorflow.python.ops import math_ops
 from tensorflow.python.ops import nn_ops
+from tensorflow.python.ops import special_math_ops
 from tensorflow.python.platform import test
 from tensorflow.python.saved_model import save as saved_model_save
+from tensorflow.python.saved_model import save_options
 from tensorflow.python.types import core
 
+# Options used when saving the test models. The models do not use custom
+# gradients, so tracing their gradient functions on save is skipped.
+_SAVE_OPTIONS = save_options.SaveOptions(experimental_custom_gradients=False)
+
+# Sizes of the einsum labels used to create sample einsum data shapes.
+_EINSUM_LABEL_TO_SIZE = {'a': 4, 'b': 32, 'c': 64, 'd': 128, 'e': 8}
+
+
+def _save_model(
+    model: module.Module,
+    saved_model_path: str,
+    signatures: Any,
+    skip_checkpoint: bool,
+) -> None:
+  """Saves `model` as a SavedModel at `saved_model_path`.
+
+  Args:
+    model: The model to save.
+    saved_model_path: Directory to write the SavedModel to.
+    signatures: Signatures of the SavedModel.
+    skip_checkpoint: If True, the variable checkpoint is not written.
+  """
+  saved_model_save.save_and_return_nodes(
+      model,
+      saved_model_path,
+      signatures=signatures,
+      options=_SAVE_OPTIONS,
+      experimental_skip_checkpoint=skip_checkpoint,
+  )
+
+
+def _get_matmul_output_shape(
+    input_shape: Sequence[Optional[int]], weight_shape: Sequence[Optional[int]]
+) -> Optional[Tuple[int, ...]]:
+  """Returns the static shape of `matmul(input, weight)`.
+
+  The batch dimensions of the operands are broadcast against each other.
+
+  Args:
+    input_shape: Shape of the matmul input.
+    weight_shape: Shape of the matmul weight.
+
+  Returns:
+    The output shape, or None if any dimension of the operands is unknown.
+  """
+  if None in input_shape or None in weight_shape:
+    return None
+
+  batch_shape = np.broadcast_shapes(
+      tuple(input_shape[:-2]), tuple(weight_shape[:-2])
+  )
+  return (*batch_shape, input_shape[-2], weight_shape[-1])
+
+
+def create_weight_constant(
+    weight: np.ndarray, quantize: bool
+) -> Tuple[core.Tensor, Optional[float]]:
+  """Creates a constant tensor holding `weight`.
+
+  Args:
+    weight: Float32 weight values.
+    quantize: If True, the weight is stored as int8 with a symmetric per-tensor
+      scale.
+
+  Returns:
+    A tuple of the weight constant and its scale. The scale is None when the
+    weight is not quantized.
+  """
+  if not quantize:
+    return array_ops.constant(weight, dtype=dtypes.float32), None
+
+  scale = float(np.max(np.abs(weight))) / 127.0 or 1.0
+  quantized_weight = np.round(weight / scale).astype(np.int8)
+  return array_ops.constant(quantized_weight, dtype=dtypes.int8), scale
+
+
+def dequantize_weight(
+    weight: core.Tensor, scale: Optional[float]
+) -> core.Tensor:
+  """Returns the float32 value of a constant from `create_weight_constant`."""
+  if scale is None:
+    return weight
+  return math_ops.cast(weight, dtypes.float32) * scale
+
 
 class QuantizedModelTest(test.TestCase, parameterized.TestCase):
   """Base test class for StableHLO quant tests."""
 
+  # Holds the temporary directories created by all test cases of the class, so
+  # that they are removed at once after the last test case.
+  _class_temp_dir: str
+
+  # If True, the models store their weights (but not their biases) as int8
+  # with a per-tensor scale and dequantize them in the graph, which makes the
+  # saved models smaller.
+  _write_int8_weights: bool = False
+
+  @classmethod
+  def setUpClass(cls) -> None:
+    super().setUpClass()
+    cls._class_temp_dir = tempfile.mkdtemp(dir=absltest.TEST_TMPDIR.value)
+
+  @classmethod
+  def tearDownClass(cls) -> None:
+    shutil.rmtree(cls._class_temp_dir, ignore_errors=True)
+    super().tearDownClass()
+
   def setUp(self) -> None:
     super().setUp()
 
-    # Many test cases for quantization involve creating and saving the input
-    # model and saving the output quantized model. These two member
-    # attributes can be used to specify the paths for such models,
-    # respectively. These paths will be cleaned up after each test case.
-    self._input_saved_model_path = self.create_tempdir('input').full_path
-    self._output_saved_model_path = self.create_tempdir('output').full_path
-    # Extra output path occasionally used for comparing two different
-    # quantized models.
-    self._output_saved_model_path_2 = self.create_tempdir('output2').full_path
+    # The saved model paths are created on first access. Drop the paths of a
+    # previous run so that each run gets fresh directories.
+    for name in (
+        '_input_saved_model_path',
+        '_output_saved_model_path',
+        '_output_saved_model_path_2',
+    ):
+      self.__dict__.pop(name, None)
+
+    # Random number generator used for creating model weights.
+    self._rng = np.random.default_rng(seed=1234)
+
+  # Many test cases for quantization involve creating and saving the input
+  # model and saving the output quantized model. These two member attributes
+  # can be used to specify the paths for such models, respectively. These
+  # paths are only created when accessed and will be cleaned up after the last
+  # test case of the class.
+  @functools.cached_property
+  def _input_saved_model_path(self) -> str:
+    return tempfile.mkdtemp(prefix='input_', dir=self._class_temp_dir)
+
+  @functools.cached_property
+  def _output_saved_model_path(self) -> str:
+    return tempfile.mkdtemp(prefix='output_', dir=self._class_temp_dir)
+
+  # Extra output path occasionally used for comparing two different quantized
+  # models.
+  @functools.cached_property
+  def _output_saved_model_path_2(self) -> str:
+    return tempfile.mkdtemp(prefix='output2_', dir=self._class_temp_dir)
 
   def _create_matmul_model(
       self,
@@ -57,11 +186,17 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
       activation_fn: Optional[ops.Operation] = None,
       bias_size: Optional[int] = None,
       use_biasadd: bool = True,
+      save: bool = True,
+      skip_checkpoint: bool = False,
   ) -> module.Module:
+    rng = self._rng
+    write_int8_weights = self._write_int8_weights
+
     class MatmulModel(module.Module):
       """A simple model with a single matmul.
 
-      Bias and activation function are optional.
+      The bias and activation function configuration is recorded for callers
+      that introspect the model, but only the matmul is part of the graph.
       """
 
       def __init__(
@@ -75,7 +210,7 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
 
         Args:
           weight_shape: Shape of the weight tensor.
-          bias_size: If None, do not use bias. Else, use given size as bias.
+          bias_size: If None, the model has no bias. Else, the size of the bias.
           activation_fn: The activation function to be used. No activation
             function if None.
           use_biasadd: If True, use BiasAdd for adding bias, else use AddV2.
@@ -83,10 +218,10 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
         self.bias_size = bias_size
         self.activation_fn = activation_fn
         self.use_biasadd = use_biasadd
-        self.filters = np.random.uniform(low=-1.0, high=1.0, size=weight_shape)
-
-        if bias_size is not None:
-          self.bias = np.random.uniform(low=-1.0, high=1.0, size=bias_size)
+        self.filters, self.filters_scale = create_weight_constant(
+            rng.uniform(low=-1.0, high=1.0, size=weight_shape).astype('f4'),
+            quantize=write_int8_weights,
+        )
 
       def has_bias(self) -> bool:
         return self.bias_size is not None
@@ -108,7 +243,11 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
         Returns:
           A map of: output key -> output result.
         """
-        out = math_ops.matmul(input_tensor, self.filters, name='sample/matmul')
+        out = math_ops.matmul(
+            input_tensor,
+            dequantize_weight(self.filters, self.filters_scale),
+            name='sample/matmul',
+        )
 
         return {'output': out}
 
@@ -121,15 +260,17 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
     assert (bias_size is None) != has_bias
 
     model = MatmulModel(weight_shape, bias_size, activation_fn)
-    saved_model_save.save(
-        model,
-        saved_model_path,
-        signatures=model.matmul.get_concrete_function(
-            tensor_spec.TensorSpec(
-                shape=input_shape, dtype=dtypes.float32, name='input_tensor'
-            )
-        ),
-    )
+    if save:
+      _save_model(
+          model,
+          saved_model_path,
+          signatures=model.matmul.get_concrete_function(
+              tensor_spec.TensorSpec(
+                  shape=input_shape, dtype=dtypes.float32, name='input_tensor'
+              )
+          ),
+          skip_checkpoint=skip_checkpoint,
+      )
     return model
 
   def _create_matmul_and_same_scale_model(
@@ -138,7 +279,16 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
       weight_shape: Sequence[int],
       saved_model_path: str,
       same_scale_op: str,
+      save: bool = True,
+      skip_checkpoint: bool = False,
   ) -> module.Module:
+    rng = self._rng
+    write_int8_weights = self._write_int8_weights
+    # Rank of the matmul output, known statically from the operand shapes.
+    out_rank = max(len(input_shape), len(weight_shape))
+    # Shape of the matmul output. None if it is not statically known.
+    out_shape = _get_matmul_output_shape(input_shape, weight_shape)
+
     class MatmulAndSameScaleModel(module.Module):
       """A simple model with a same-scale op.
 
@@ -157,9 +307,25 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
           same_scale_op: Name of the same-scale op to be tested. Raises error
             when an unknown name is given.
         """
-        self.filters = np.random.uniform(low=-1.0, high=1.0, size=weight_shape)
+        self.filters, self.filters_scale = create_weight_constant(
+            rng.uniform(low=-1.0, high=1.0, size=weight_shape).astype('f4'),
+            quantize=write_int8_weights,
+        )
         self.same_scale_op = same_scale_op
 
+        # Ones of the matmul output shape, or None if the shape is dynamic.
+        self.ones = None
+        if same_scale_op in ('concatenate', 'select') and out_shape is not None:
+          self.ones = array_ops.ones(out_shape, dtype=dtypes.float32)
+
+        if same_scale_op == 'select':
+          if out_shape is None:
+            raise ValueError('select requires a static matmul output shape.')
+          cond_rng = np.random.default_rng(seed=1234)
+          self.select_condition = array_ops.constant(
+              cond_rng.uniform(low=0.0, high=1.0, size=out_shape) < 0.5
+          )
+
       @def_function.function
       def matmul_and_same_scale(
           self, input_tensor: core.Tensor
@@ -172,34 +338,34 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
         Returns:
           A map of: output key -> output result.
         """
-        out = math_ops.matmul(input_tensor, self.filters, name='sample/matmul')
+        out = math_ops.matmul(
+            input_tensor,
+            dequantize_weight(self.filters, self.filters_scale),
+            name='sample/matmul',
+        )
 
         if self.same_scale_op == 'concatenate':
-          ones = array_ops.ones_like(out)
+          ones = self.ones
+          if ones is None:
+            ones = array_ops.ones_like(out)
           out = array_ops.concat([out, ones], 0)
         elif self.same_scale_op == 'gather':
           out = array_ops.gather(out, indices=[0], axis=0)
         elif self.same_scale_op == 'pad':
-          paddings = array_ops.ones(
-              (array_ops.rank(out), 2), dtype=dtypes.int32
+          paddings = array_ops.constant(
+              [[1, 1]] * out_rank, dtype=dtypes.int32
           )
           out = array_ops.pad(out, paddings, 'CONSTANT')
         elif self.same_scale_op == 'reshape':
-          out = array_ops.reshape(out, (array_ops.size(out), -1))
+          if out_shape is not None:
+            out = array_ops.reshape(out, (int(np.prod(out_shape)), 1))
+          else:
+            out = array_ops.reshape(out, (array_ops.size(out), -1))
         elif self.same_scale_op == 'select':
-          rng = np.random.default_rng(seed=1234)
-          condition = ops.convert_to_tensor(
-              rng.uniform(low=0.0, high=1.0, size=out.shape) < 0.5
-          )
-          ones = array_ops.ones_like(out)
-          out = math_ops.select(condition, out, ones)
+          out = math_ops.select(self.select_condition, out, self.ones)
         elif self.same_scale_op == 'slice':
-          begin = array_ops.zeros(
-              (array_ops.rank(out)), dtype=dtypes.int32
-          )
-          size = array_ops.ones(
-              (array_ops.rank(out)), dtype=dtypes.int32
-          )
+          begin = array_ops.constant([0] * out_rank, dtype=dtypes.int32)
+          size = array_ops.constant([1] * out_rank, dtype=dtypes.int32)
           out = array_ops.slice(out, begin, size)
         elif self.same_scale_op == 'transpose':
           out = array_ops.transpose(out)
@@ -213,15 +379,17 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
         return {'output': out}
 
     model = MatmulAndSameScaleModel(weight_shape, same_scale_op)
-    saved_model_save.save(
-        model,
-        saved_model_path,
-        signatures=model.matmul_and_same_scale.get_concrete_function(
-            tensor_spec.TensorSpec(
-                shape=input_shape, dtype=dtypes.float32, name='input_tensor'
-            )
-        ),
-    )
+    if save:
+      _save_model(
+          model,
+          saved_model_path,
+          signatures=model.matmul_and_same_scale.get_concrete_function(
+              tensor_spec.TensorSpec(
+                  shape=input_shape, dtype=dtypes.float32, name='input_tensor'
+              )
+          ),
+          skip_checkpoint=skip_checkpoint,
+      )
     return model
 
   def _create_conv2d_model(
@@ -235,7 +403,12 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
       strides: Sequence[int] = (1, 1, 1, 1),
       dilations: Sequence[int] = (1, 1, 1, 1),
       padding: str = 'SAME',
+      save: bool = True,
+      skip_checkpoint: bool = False,
   ) -> module.Module:
+    rng = self._rng
+    write_int8_weights = self._write_int8_weights
+
     class ConvModel(module.Module):
       """A simple model with a single conv2d, bias and relu."""
 
@@ -243,19 +416,29 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
         self.out_channel_size = filter_shape[-1]
 
         # This ensures filters will have different value range per out channel
-        self.filters = np.stack(
-            [
-                np.random.uniform(
-                    low=-(i + 1), high=(i + 1), size=filter_shape[:-1]
-                ).astype('f4')
-                for i in range(self.out_channel_size)
-            ],
-            axis=-1,
+        filters = rng.uniform(low=-1.0, high=1.0, size=filter_shape).astype(
+            'f4', copy=False
+        )
+        scale = np.arange(1, self.out_channel_size + 1, dtype='f4')
+        self.filters, self.filters_scale = create_weight_constant(
+            filters * scale, quantize=write_int8_weights
         )
 
-        self.bias = np.random.uniform(
-            low=0, high=10, size=(self.out_channel_size)
-        ).astype('f4')
+        self.bias = array_ops.constant(
+            rng.uniform(low=0, high=10, size=(self.out_channel_size)).astype(
+                'f4'
+            ),
+            dtype=dtypes.float32,
+        )
+
+        # Batch norm parameters. The mean and variance reuse the scale and
+        # offset values respectively.
+        self.bn_scale = array_ops.constant(
+            [1.0] * self.out_channel_size, dtype=dtypes.float32
+        )
+        self.bn_offset = array_ops.constant(
+            [0.5] * self.out_channel_size, dtype=dtypes.float32
+        )
 
       @def_function.function
       def conv2d(self, input_tensor: core.Tensor) -> Mapping[str, core.Tensor]:
@@ -267,12 +450,9 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
         Returns:
           A map of: output key -> output result.
         """
-        scale = [1.0] * self.out_channel_size
-        offset = [0.5] * self.out_channel_size
-        mean, variance = scale, offset
         out = nn_ops.conv2d(
             input_tensor,
-            self.filters,
+            dequantize_weight(self.filters, self.filters_scale),
             strides=strides,
             dilations=dilations,
             padding=padding,
@@ -282,20 +462,27 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
         if has_batch_norm:
           # Fusing is supported for non-training case.
           out, _, _, _, _, _ = nn_ops.fused_batch_norm_v3(
-              out, scale, offset, mean, variance, is_training=False
+              out,
+              scale=self.bn_scale,
+              offset=self.bn_offset,
+              mean=self.bn_scale,
+              variance=self.bn_offset,
+              is_training=False,
           )
         return {'output': out}
 
     model = ConvModel()
-    saved_model_save.save(
-        model,
-        saved_model_path,
-        signatures=model.conv2d.get_concrete_function(
-            tensor_spec.TensorSpec(
-                shape=input_shape, dtype=dtypes.float32, name='input_tensor'
-            )
-        ),
-    )
+    if save:
+      _save_model(
+          model,
+          saved_model_path,
+          signatures=model.conv2d.get_concrete_function(
+              tensor_spec.TensorSpec(
+                  shape=input_shape, dtype=dtypes.float32, name='input_tensor'
+              )
+          ),
+          skip_checkpoint=skip_checkpoint,
+      )
     return model
 
   # Prepares sample einsum input data shapes.
@@ -325,21 +512,16 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
     out_labels = equation[arrow_pos + 1 :]
 
     # 2. Create sample shapes.
-    label_to_size = {'a': 4, 'b': 32, 'c': 64, 'd': 128, 'e': 8}
-    x_shape = [label_to_size.get(x_label) for x_label in x_labels]
-    y_shape = [label_to_size.get(y_label) for y_label in y_labels]
+    x_shape = [_EINSUM_LABEL_TO_SIZE.get(x_label) for x_label in x_labels]
+    y_shape = [_EINSUM_LABEL_TO_SIZE.get(y_label) for y_label in y_labels]
     bias_shape = None
     if use_bias:
-      bias_shape = [label_to_size.get(out_label) for out_label in out_labels]
-      bias_shape = bias_shape[-1:]
-    contracting_dims = set()
+      bias_shape = [_EINSUM_LABEL_TO_SIZE.get(out_labels[-1])]
 
     x_signature = list(x_shape)
     y_signature = list(y_shape)
     if generate_unknown_shape_signature:
-      for c in x_labels:
-        if c in y_labels:
-          contracting_dims.add(c)
+      contracting_dims = set(x_labels) & set(y_labels)
       x_signature = [
           None if c not in contracting_dims else x_shape[cidx]
           for cidx, c in enumerate(x_labels)
@@ -358,7 +540,18 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
       x_signature: Sequence[Optional[int]],
       y_signature: Sequence[Optional[int]],
       bias_shape: Optional[Sequence[int]] = None,
+      save: bool = True,
+      skip_checkpoint: bool = False,
   ) -> module.Module:
+    rng = self._rng
+    write_int8_weights = self._write_int8_weights
+    x_spec = tensor_spec.TensorSpec(
+        name='x', shape=x_signature, dtype=dtypes.float32
+    )
+    y_spec = tensor_spec.TensorSpec(
+        name='y', shape=y_signature, dtype=dtypes.float32
+    )
+
     class EinsumModel(module.Module):
       """Einsum class."""
 
@@ -366,52 +559,44 @@ class QuantizedModelTest(test.TestCase, parameterized.TestCase):
         self._bias = None
         if bias_shape is not None:
           self._bias = array_ops.constant(
-              np.random.uniform(size=bias_shape), dtype=dtypes.float32
+              rng.uniform(size=bias_shape).astype('f4'), dtype=dtypes.float32
           )
 
-        self._kernel = np.random.uniform(size=y_shape).astype('f4')
+        self._kernel, self._kernel_scale = create_weight_constant(
+            rng.uniform(size=y_shape).astype('f4'), quantize=write_int8_weights
+        )
         self._min = (-0.8, -0.8, -0.9)
         self._max = (0.9, 0.9, 1.0)
 
-      @def_function.function(
-          input_signature=[
-              tensor_spec.TensorSpec(
-                  name='x', shape=x_signature, dtype=dtypes.float32
-              )
-          ]
-      )
+      @def_function.function(input_signature=[x_spec])
       def einsum_with_kernel(self, x: core.Tensor) -> Mapping[str, core.Tensor]:
-        return self._einsum(x, self._kernel)
+        return self._einsum(
+            x, dequantize_weight(self._kernel, self._kernel_scale)
+        )
 
-      @def_function.function(
-          input_signature=[
-              tensor_spec.TensorSpec(
-                  name='x', shape=x_signature, dtype=dtypes.float32
-              ),
-              tensor_spec.TensorSpec(
-                  name='y', shape=y_signature, dtype=dtypes.float32
-              ),
-          ]
-      )
+      @def_function.function(input_signature=[x_spec, y_spec])
       def einsum_without_kernel(
           self, x: core.Tensor, y: core.Tensor
       ) -> Mapping[str, core.Tensor]:
         return self._einsum(x, y)
 
       def _einsum(self, x, y):
-
-        out = tensorflow.einsum(equation, x, y)
+        out = special_math_ops.einsum(equation, x, y)
         if self._bias is not None:
           out = nn_ops.bias_add(out, self._bias)
         return {'output': out}
 
     model = EinsumModel()
-    signatures = {
-        'serving_default': model.einsum_with_kernel.get_concrete_function(
-            tensor_spec.TensorSpec(
-                name='x', shape=x_signature, dtype=dtypes.float32
-            )
-        ),
-    }
-    saved_model_save.save(model, saved_model_path, signatures=signatures)
+    if save:
+      signatures = {
+          'serving_default': model.einsum_with_kernel.get_concrete_function(
+              x_spec
+          ),
+      }
+      _save_model(
+          model,
+          saved_model_path,
+          signatures=signatures,
+          skip_checkpoint=skip_checkpoint,
+      )
     return model